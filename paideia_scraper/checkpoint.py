@@ -0,0 +1,60 @@
+import json
+import os
+import threading
+
+
+# Append-only JSONL record of every parent scraped so far, one line per
+# (class, student, parent), so an interrupted run can pick up where it left off
+class Checkpoint:
+    def __init__(self, path):
+        self._classes = {}
+        if os.path.exists(path):
+            complete_size = 0
+            with open(path, "rb") as f:
+                for line in f:
+                    # Every record ends in a newline, anything after the last
+                    # one is a partial write from a crash
+                    if not line.endswith(b"\n"):
+                        break
+                    record = json.loads(line)
+                    class_students = self._classes.setdefault(record["class"], {})
+                    student = class_students.setdefault(record["student"], {})
+                    if record["parent"] is not None:
+                        student[record["parent"]] = {
+                            "email": record["email"],
+                            "phone": record["phone"],
+                        }
+                    complete_size += len(line)
+            # Drop the partial line so new records don't get appended to it
+            os.truncate(path, complete_size)
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Line buffered so each student's records reach the file as soon as
+        # they are written
+        self._file = open(path, "a", buffering=1)
+        self._lock = threading.Lock()
+
+    def get_class(self, class_name):
+        return self._classes.get(class_name, {})
+
+    def record(self, class_name, student_name, parent_info):
+        # Students without parents still get a line so they aren't scraped again
+        parents = parent_info.items() or [(None, {"email": None, "phone": None})]
+        lines = "".join(
+            json.dumps(
+                {
+                    "class": class_name,
+                    "student": student_name,
+                    "parent": parent_name,
+                    **info,
+                }
+            )
+            + "\n"
+            for parent_name, info in parents
+        )
+        with self._lock:
+            self._file.write(lines)
+
+    def close(self):
+        self._file.close()
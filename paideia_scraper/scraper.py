@@ -0,0 +1,623 @@
+from selenium import webdriver
+from selenium.webdriver.common.by import By
+from selenium.webdriver.chrome.service import Service
+from selenium.webdriver.support.wait import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
+import logging
+import os
+import functools
+import json
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from selenium.common.exceptions import (
+    StaleElementReferenceException,
+    TimeoutException,
+    WebDriverException,
+)
+import contextlib
+import queue
+import signal
+import threading
+import time
+
+
+log = logging.getLogger(__name__)
+
+STUDENT_DIRECTORY_URL = "https://www.paideiaschool.org/parent-portal/student-directory"
+
+# Cookies can only be added for the domain currently loaded, so this is a
+# cheap page on the portal domain to load before restoring them
+COOKIE_DOMAIN_URL = "https://www.paideiaschool.org/robots.txt"
+COOKIE_FILE = os.path.expanduser("~/.paideia-scraper/cookies.json")
+
+# Element locators
+LOC_USERNAME = (By.NAME, "username")
+LOC_PASSWORD = (By.NAME, "password")
+LOC_SEARCH_LOCATION = (By.NAME, "const_search_location")
+LOC_RELATIONSHIPS = (By.CLASS_NAME, "fsRelationships")
+LOC_CONTACTS = (By.CLASS_NAME, "fsContacts")
+
+# Map of class name to group id for every option in the Location menu
+GROUP_IDS_SCRIPT = """
+const select = document.querySelector('[name="const_search_location"]');
+return Object.fromEntries(
+    Array.from(select.options, o => [o.textContent.trim(), o.value])
+);
+"""
+
+# Raw search params of the current results, null while they are being
+# replaced. Read in the page so each poll is one call that can't go stale.
+SEARCH_PARAMS_SCRIPT = """
+const pagination = document.querySelector('.fsElementPagination');
+return pagination ? pagination.getAttribute('data-searchparams') : null;
+"""
+
+# Choose a group id in the Location menu and return the menu for submitting.
+# Setting the value fires no events, so send the change a user's pick would.
+SELECT_LOCATION_SCRIPT = """
+const select = document.querySelector('[name="const_search_location"]');
+select.value = arguments[0];
+select.dispatchEvent(new Event('input', {bubbles: true}));
+select.dispatchEvent(new Event('change', {bubbles: true}));
+return select;
+"""
+
+# Name and link element of every student in the results. The profile link
+# class appears twice per student, skip the second case with a child span.
+STUDENT_LINKS_SCRIPT = """
+return Array.from(document.querySelectorAll('.fsConstituentProfileLink'))
+    .filter(e => !e.querySelector('span'))
+    .map(e => [e.textContent.trim(), e]);
+"""
+
+# Click the element passed in
+CLICK_SCRIPT = "arguments[0].click();"
+
+# Click the close button of the topmost dialog, the last one still rendered. A
+# student dialog can stay open under a parent dialog, and the first button in
+# the document would then close the wrong one. False if none is rendered.
+CLOSE_DIALOG_SCRIPT = """
+const buttons = Array.from(document.querySelectorAll('.fsDialogCloseButton'))
+    .filter(e => e.getClientRects().length > 0);
+if (buttons.length === 0) {
+    return false;
+}
+buttons[buttons.length - 1].click();
+return true;
+"""
+
+# Click the named parent in the student dialog's relationships element passed
+# in, false if not listed
+CLICK_PARENT_SCRIPT = """
+const link = Array.from(
+    arguments[0].querySelectorAll('.fsRelationshipParent .fsConstituentProfileLink')
+).find(e => e.textContent.trim() === arguments[1]);
+if (!link) return false;
+link.click();
+return true;
+"""
+
+# Names of the parents listed in the student dialog's relationships element
+# passed in
+PARENT_NAMES_SCRIPT = """
+return Array.from(
+    arguments[0].querySelectorAll('.fsRelationshipParent .fsConstituentProfileLink'),
+    e => e.textContent.trim()
+);
+"""
+
+# Email and mobile number from an open parent dialog, null when not listed
+CONTACT_INFO_SCRIPT = """
+const contacts = arguments[0];
+const email = contacts.querySelector('.fsEmailHome .fsStyleSROnly');
+const phones = contacts.querySelectorAll('.fsPhoneMobile div');
+return {
+    email: email ? email.textContent.trim() : null,
+    phone: phones.length > 1 ? phones[1].textContent.trim() : null,
+};
+"""
+
+# Requests dropped at the browser network layer, none of which carry
+# directory data
+BLOCKED_URLS = [
+    "*.googletagmanager.com/*",
+    "*.google-analytics.com/*",
+    "*.doubleclick.net/*",
+    "*.hotjar.com/*",
+    "*.segment.io/*",
+    "*.segment.com/*",
+    "*.facebook.net/*",
+    "*.woff",
+    "*.woff2",
+    "*.ttf",
+    "*.png",
+    "*.jpg",
+    "*.jpeg",
+    "*.gif",
+    "*.svg",
+    "*.webp",
+    "*.mp4",
+    "*.webm",
+]
+
+# Explicit waits return as soon as their condition holds, so these only bound
+# how long we wait for something that never happens
+WAIT_TIMEOUT = 30
+POLL_FREQUENCY = 0.05
+
+# The WebDriver default is five minutes, fail a stuck navigation much sooner.
+# This bounds each attempt, so all NAVIGATE_ATTEMPTS together still give up
+# within 30 seconds of loading, plus the backoff between them.
+PAGE_LOAD_TIMEOUT = 10
+
+# Attempts at a navigation that hits PAGE_LOAD_TIMEOUT before giving up, with
+# a pause before each retry that doubles every time
+NAVIGATE_ATTEMPTS = 3
+NAVIGATE_BACKOFF = 1
+
+# Logging in can be slow, give the portal much longer to show the directory
+LOGIN_TIMEOUT = 600
+
+# How long a browser gets to quit before it and its chromedriver are killed
+QUIT_TIMEOUT = 10
+
+# Maximum number of independent browser sessions scraping at once
+MAX_WORKERS = 4
+
+
+def chrome_options(headless=True):
+    options = webdriver.ChromeOptions()
+    if headless:
+        options.add_argument("--headless=new")
+    # Headless defaults to a small window, keep the portal's desktop layout
+    options.add_argument("--window-size=1280,1024")
+    options.add_argument("--disable-gpu")
+    options.add_argument("--disable-extensions")
+
+    # Skip profile setup and background traffic a throwaway session never uses
+    options.add_argument("--no-first-run")
+    options.add_argument("--disable-background-networking")
+    options.add_argument("--disable-sync")
+
+    # We only ever read text, so don't fetch or decode images, and never
+    # stop for a notification permission prompt. Stylesheets stay enabled,
+    # the dialog waits rely on elements becoming invisible.
+    options.add_argument("--blink-settings=imagesEnabled=false")
+    options.add_experimental_option(
+        "prefs",
+        {
+            "profile.managed_default_content_settings.images": 2,
+            "profile.default_content_setting_values.notifications": 2,
+        },
+    )
+
+    # Return from navigation at DOMContentLoaded instead of waiting for
+    # trackers and other subresources; explicit waits cover the rest
+    options.page_load_strategy = "eager"
+    return options
+
+
+def navigate(driver, url, attempts=NAVIGATE_ATTEMPTS):
+    # A single slow load shouldn't abort the whole run, stop it and try again
+    for attempt in range(1, attempts + 1):
+        try:
+            driver.get(url)
+            return
+        except TimeoutException:
+            if attempt == attempts:
+                raise
+            log.warning(
+                "Timed out loading %s, retrying (%d/%d)", url, attempt, attempts
+            )
+            try:
+                driver.execute_script("window.stop();")
+            except WebDriverException:
+                # The next get() replaces the page anyway
+                pass
+            time.sleep(NAVIGATE_BACKOFF * 2 ** (attempt - 1))
+
+
+def chrome_service():
+    # Start chromedriver in its own process group, so it can be killed along
+    # with the Chrome processes it started if it stops responding
+    return Service(popen_kw={"start_new_session": True})
+
+
+def quit_driver(driver):
+    # quit() can hang on an unresponsive browser, so run it on the side and
+    # give up on it after QUIT_TIMEOUT
+    quit_errors = []
+
+    def run_quit():
+        try:
+            driver.quit()
+        except Exception as e:
+            quit_errors.append(e)
+
+    quitter = threading.Thread(target=run_quit, daemon=True)
+    quitter.start()
+    quitter.join(QUIT_TIMEOUT)
+    if not quitter.is_alive() and not quit_errors:
+        return
+
+    log.warning("Failed to quit browser, killing it")
+    process = driver.service.process
+    if process is None:
+        return
+    try:
+        if hasattr(os, "killpg"):
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+    except ProcessLookupError:
+        pass
+
+
+def load_cookies(driver):
+    try:
+        with open(COOKIE_FILE) as f:
+            cookies = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return False
+
+    navigate(driver, COOKIE_DOMAIN_URL)
+    for cookie in cookies:
+        # Chrome rejects some sameSite values it reports itself, and the
+        # default is fine for restoring a session
+        cookie.pop("sameSite", None)
+        driver.add_cookie(cookie)
+    return True
+
+
+def save_cookies(driver):
+    # Write atomically, parallel workers may be saving at the same time
+    cookie_dir = os.path.dirname(COOKIE_FILE)
+    os.makedirs(cookie_dir, mode=0o700, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=cookie_dir)
+    with os.fdopen(fd, "w") as f:
+        json.dump(driver.get_cookies(), f)
+    os.replace(tmp_path, COOKIE_FILE)
+
+
+def login(headless=True):
+    user = os.environ.get("PAIDEIA_USER")
+    if not user:
+        exit("must set PAIDEIA_USER")
+    password = os.environ.get("PAIDEIA_PASSWORD")
+    if not password:
+        exit("must set PAIDEIA_PASSWORD")
+
+    driver = webdriver.Chrome(
+        options=chrome_options(headless), service=chrome_service()
+    )
+    try:
+        open_directory(driver, user, password, headless)
+    except BaseException:
+        # The caller only gets to clean up the browser once we return it
+        quit_driver(driver)
+        raise
+    return driver
+
+
+def open_directory(driver, user, password, headless=True):
+    # Only explicit waits, an implicit wait would stretch every find_elements
+    # probe that is expected to come back empty
+    driver.implicitly_wait(0)
+    driver.set_page_load_timeout(PAGE_LOAD_TIMEOUT)
+    driver.execute_cdp_cmd("Network.enable", {})
+    driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": BLOCKED_URLS})
+    load_cookies(driver)
+    navigate(driver, STUDENT_DIRECTORY_URL)
+
+    # With a still valid session we land directly on the directory
+    wait(driver).until(
+        EC.any_of(
+            EC.presence_of_element_located(LOC_SEARCH_LOCATION),
+            EC.presence_of_element_located(LOC_USERNAME),
+        )
+    )
+    if driver.find_elements(*LOC_SEARCH_LOCATION):
+        return
+
+    # Enter username and password
+    user_elem = driver.find_element(*LOC_USERNAME)
+    user_elem.send_keys(user)
+
+    password_elem = driver.find_element(*LOC_PASSWORD)
+    password_elem.send_keys(password)
+    password_elem.submit()
+
+    # A rejected login comes back to the login form. Headless there is nobody
+    # to correct it, so fail right away instead of waiting out LOGIN_TIMEOUT.
+    # The old form has to go away first, it is still there right after submit.
+    if headless:
+        try:
+            wait(driver, LOGIN_TIMEOUT).until(
+                EC.any_of(
+                    EC.presence_of_element_located(LOC_SEARCH_LOCATION),
+                    EC.all_of(
+                        EC.staleness_of(password_elem),
+                        EC.presence_of_element_located(LOC_USERNAME),
+                    ),
+                )
+            )
+        except TimeoutException:
+            exit("login failed, check PAIDEIA_USER and PAIDEIA_PASSWORD")
+        if not driver.find_elements(*LOC_SEARCH_LOCATION):
+            exit("login failed, check PAIDEIA_USER and PAIDEIA_PASSWORD")
+
+    # Wait for the directory to show up before saving the session
+    wait(driver, LOGIN_TIMEOUT).until(
+        EC.presence_of_element_located(LOC_SEARCH_LOCATION)
+    )
+    save_cookies(driver)
+
+
+def wait(driver, timeout=WAIT_TIMEOUT):
+    # Dialog elements can be removed between finding them and checking them,
+    # treat that like not found and poll again
+    return WebDriverWait(
+        driver,
+        timeout,
+        poll_frequency=POLL_FREQUENCY,
+        ignored_exceptions=[StaleElementReferenceException],
+    )
+
+
+# Closed dialogs can stay in the document hidden, so dialog waits only look at
+# rendered elements and take the last, topmost, one
+def wait_dialog_open(driver, locator):
+    return wait(driver).until(EC.visibility_of_any_elements_located(locator))[-1]
+
+
+def wait_dialog_closed(driver, locator):
+    wait(driver).until(EC.none_of(EC.visibility_of_any_elements_located(locator)))
+
+
+def get_search_params(driver):
+    return driver.execute_script(SEARCH_PARAMS_SCRIPT)
+
+
+def get_group_id(raw_params):
+    search_params = json.loads(raw_params)
+    return search_params["const_search_location"]
+
+
+def get_group_ids(driver):
+    # Make sure "Location" is visible, as after login
+    wait(driver).until(EC.presence_of_element_located(LOC_SEARCH_LOCATION))
+    return driver.execute_script(GROUP_IDS_SCRIPT)
+
+
+def get_class_students(driver, class_name, group_ids):
+    # Make sure "Location" is visible, as after login
+    wait(driver).until(EC.presence_of_element_located(LOC_SEARCH_LOCATION))
+
+    group_id = group_ids[class_name]
+    log.info("Looking up students in class '%s' (%s)", class_name, group_id)
+
+    # A pooled browser may already show this class. Submitting again would
+    # replace the results under us with nothing to wait for, so keep them.
+    old_params = get_search_params(driver)
+    if old_params is None or get_group_id(old_params) != group_id:
+        # Set the location
+        select_elem = driver.execute_script(SELECT_LOCATION_SCRIPT, group_id)
+        select_elem.submit()
+
+        # Make sure the given class is loaded. Polling only compares the raw
+        # attribute, it is parsed once it has actually changed.
+        wait(driver).until(
+            lambda d: (params := get_search_params(d)) not in (None, old_params)
+            and get_group_id(params) == group_id
+        )
+
+    # Fetch all student elements
+    students = dict(driver.execute_script(STUDENT_LINKS_SCRIPT))
+    if log.isEnabledFor(logging.DEBUG):
+        for student_name in students:
+            log.debug("Found student %s", student_name)
+
+    return students
+
+
+def open_student_dialog(driver, student_elem):
+    # Click in the page, a native click scrolls the link into view first and
+    # can be intercepted by the overlay of a dialog that is still fading out
+    driver.execute_script(CLICK_SCRIPT, student_elem)
+
+    return wait_dialog_open(driver, LOC_RELATIONSHIPS)
+
+
+def close_student_dialog(driver):
+    if not driver.execute_script(CLOSE_DIALOG_SCRIPT):
+        exit("failed to find the student dialog close button")
+    wait_dialog_closed(driver, LOC_RELATIONSHIPS)
+
+
+def is_student_dialog_open(driver):
+    try:
+        return bool(EC.visibility_of_any_elements_located(LOC_RELATIONSHIPS)(driver))
+    except StaleElementReferenceException:
+        # Removed while being checked, so it was closing
+        return False
+
+
+def open_parent_dialog(driver, relationships_elem, parent_name):
+    # Assumes the student dialog holding relationships_elem is open
+    if not driver.execute_script(CLICK_PARENT_SCRIPT, relationships_elem, parent_name):
+        exit(f"failed to find parent {parent_name}")
+
+    # The wait hands back the element it found, no need to look it up again
+    return wait_dialog_open(driver, LOC_CONTACTS)
+
+
+def close_parent_dialog(driver):
+    if not driver.execute_script(CLOSE_DIALOG_SCRIPT):
+        exit("failed to find the parent dialog close button")
+    wait_dialog_closed(driver, LOC_CONTACTS)
+
+
+def get_parent_info(driver, students, on_student=None, stop=None):
+    student_parent_info = {}
+
+    for student_name, student_elem in students.items():
+        # Finish the student in progress but don't start another once asked to
+        # stop, everything recorded so far is kept in the checkpoint
+        if stop and stop.is_set():
+            break
+        student_parent_info[student_name] = {}
+
+        # Read the parents from the same dialog used to open the first of them
+        relationships_elem = open_student_dialog(driver, student_elem)
+        student_dialog_open = True
+        parent_name_list = driver.execute_script(
+            PARENT_NAMES_SCRIPT, relationships_elem
+        )
+        for parent_name in parent_name_list:
+            if not student_dialog_open:
+                relationships_elem = open_student_dialog(driver, student_elem)
+            contacts_elem = open_parent_dialog(driver, relationships_elem, parent_name)
+
+            # Get the contact email and mobile number
+            parent_info = driver.execute_script(CONTACT_INFO_SCRIPT, contacts_elem)
+            log.debug(
+                "Found parent %s for student %s, email %s, mobile number %s",
+                parent_name,
+                student_name,
+                parent_info["email"],
+                parent_info["phone"],
+            )
+
+            close_parent_dialog(driver)
+
+            # Only reopen the student dialog if closing the parent dismissed it
+            student_dialog_open = is_student_dialog_open(driver)
+
+            student_parent_info[student_name][parent_name] = parent_info
+
+        if student_dialog_open:
+            close_student_dialog(driver)
+
+        if on_student:
+            on_student(student_name, student_parent_info[student_name])
+
+    return student_parent_info
+
+
+# Logged in browsers shared by every class, so each one only pays for Chrome
+# startup and login once. Browsers are created on demand, the thread pools
+# already bound how many are in use at the same time.
+class DriverPool:
+    def __init__(self, headless=True):
+        self._headless = headless
+        self._idle = queue.SimpleQueue()
+        self._drivers = []
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def driver(self):
+        try:
+            driver = self._idle.get_nowait()
+        except queue.Empty:
+            driver = login(self._headless)
+            with self._lock:
+                self._drivers.append(driver)
+
+        # A browser that failed part way may be left with a dialog open, so
+        # only hand it out again after a clean run
+        yield driver
+        self._idle.put(driver)
+
+    def close(self):
+        # Safe to call more than once, each browser is only quit the first time
+        with self._lock:
+            drivers, self._drivers = self._drivers, []
+        for driver in drivers:
+            quit_driver(driver)
+
+
+def get_parent_info_worker(
+    pool, class_name, group_ids, student_names, on_student, stop=None
+):
+    if stop and stop.is_set():
+        return {}
+
+    # WebDriver is not thread safe, so each worker gets its own browser
+    with pool.driver() as driver:
+        students = get_class_students(driver, class_name, group_ids)
+        students = {name: students[name] for name in student_names}
+        return get_parent_info(driver, students, on_student, stop)
+
+
+def scrape_class(
+    class_name, group_ids, pool, workers=MAX_WORKERS, checkpoint=None, stop=None
+):
+    done = checkpoint.get_class(class_name) if checkpoint else {}
+    on_student = (
+        functools.partial(checkpoint.record, class_name) if checkpoint else None
+    )
+
+    with pool.driver() as driver:
+        students = get_class_students(driver, class_name, group_ids)
+
+        # Split students round-robin across workers
+        student_names = [name for name in students if name not in done]
+        workers = max(1, min(workers, len(student_names)))
+        chunks = [student_names[i::workers] for i in range(workers)]
+
+        # This browser already has the class loaded, so it takes the first
+        # share itself and the other workers load it in their own browsers
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(
+                    get_parent_info_worker,
+                    pool,
+                    class_name,
+                    group_ids,
+                    chunk,
+                    on_student,
+                    stop,
+                )
+                for chunk in chunks[1:]
+            ]
+            parent_info = get_parent_info(
+                driver, {name: students[name] for name in chunks[0]}, on_student, stop
+            )
+            for future in futures:
+                parent_info.update(future.result())
+
+    return {**done, **parent_info}
+
+
+def scrape_classes(class_names, group_ids, pool, workers=MAX_WORKERS, checkpoint=None):
+    # Classes are independent, so scrape them side by side and split the
+    # remaining browser budget between their parent info workers. Repeats
+    # would each start their own scrape of the same class.
+    class_names = list(dict.fromkeys(class_names))
+    class_workers = max(1, min(workers, len(class_names)))
+    parent_workers = max(1, workers // class_workers)
+
+    # Ctrl-C only reaches this thread. Tell the workers to stop after their
+    # current student and drop classes that haven't started, rather than
+    # waiting for every class to finish.
+    stop = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=class_workers)
+    try:
+        futures = {
+            class_name: executor.submit(
+                scrape_class,
+                class_name,
+                group_ids,
+                pool,
+                parent_workers,
+                checkpoint,
+                stop,
+            )
+            for class_name in class_names
+        }
+        return {class_name: future.result() for class_name, future in futures.items()}
+    except KeyboardInterrupt:
+        stop.set()
+        raise
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)